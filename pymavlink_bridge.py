@@ -1,19 +1,61 @@
 #!/usr/bin/env python3
 """Pymavlink bridge for socket_viewer."""
 
+import array
 import base64
+import concurrent.futures
 import csv
 import io
 import json
+import math
 import os
 import queue
 import sys
 import threading
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from pymavlink import mavutil
 
+try:
+    import orjson
+except ImportError:  # optional, falls back to stdlib json
+    orjson = None
+
+
+if orjson is not None:
+    # orjson rejects ints beyond 64 bits that stdlib json encodes; fall back
+    # rather than letting one odd value break every later emit.
+
+    def _encode(value: Any) -> bytes:
+        try:
+            return orjson.dumps(value)
+        except orjson.JSONEncodeError:
+            return json.dumps(value).encode("utf-8")
+
+    def _dumps(payload: Dict[str, Any]) -> bytes:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_APPEND_NEWLINE)
+        except orjson.JSONEncodeError:
+            return (json.dumps(payload) + "\n").encode("utf-8")
+
+    _loads = orjson.loads
+else:
+
+    def _encode(value: Any) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def _dumps(payload: Dict[str, Any]) -> bytes:
+        return (json.dumps(payload) + "\n").encode("utf-8")
+
+    _loads = json.loads
+
+# Fixed envelope around the telemetry state so only the state dict is encoded.
+_TELEMETRY_PREFIX = b'{"type":"telemetry","data":'
+_TELEMETRY_SUFFIX = b"}\n"
+# SLAM timestamps (ms) must fit the int64 columns and encoders downstream.
+_MAX_TIMESTAMP_MS = 2**63 - 1
+
 DEFAULT_CONNECTION = os.getenv(
     "PYMAVLINK_CONNECTION",
     os.getenv("MAVLINK_CONNECTION", "udp:127.0.0.1:14551"),
@@ -25,12 +67,101 @@ MODE_EXTRA_FLAGS = {
     "RTL": mavutil.mavlink.MAV_MODE_FLAG_AUTO_ENABLED,
     "STABILIZE": mavutil.mavlink.MAV_MODE_FLAG_STABILIZE_ENABLED,
 }
+_MAV_STATE_NAMES = {
+    key: getattr(entry, "name", str(key))
+    for key, entry in mavutil.mavlink.enums.get("MAV_STATE", {}).items()
+}
+_SAFETY_ARMED = mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+_READY_STATES = frozenset(
+    (mavutil.mavlink.MAV_STATE_STANDBY, mavutil.mavlink.MAV_STATE_ACTIVE)
+)
+CMD_WORKERS = int(os.getenv("PYMAVLINK_CMD_WORKERS", "2"))
+# Commands that never block (in-process state or a couple of sends); they run
+# on the main loop. Only takeoff, which waits on the vehicle, uses the pool.
+INLINE_COMMANDS = frozenset(("set_mode", "csv_start"))
+CSV_HEADER = (
+    "timestamp_log",
+    "timestamp_slam",
+    "slam_x",
+    "slam_y",
+    "slam_z",
+    "timestamp_mavlink",
+    "gps_lat",
+    "gps_lon",
+    "gps_alt",
+    "gps_alt_rel",
+)
+# array.array typecode per CSV column. Missing values are stored as 0 and
+# flagged in a per-row bitmask so they are written back out as empty cells.
+CSV_COLUMN_TYPES = ("q", "q", "d", "d", "d", "q", "d", "d", "d", "d")
 STATUS_HOLD_SECONDS = float(os.getenv("PYMAVLINK_STATUS_HOLD_SECONDS", "4"))
+MIN_STATE_EMIT_INTERVAL = float(os.getenv("PYMAVLINK_STATE_MIN_MS", "33")) / 1000
+EMIT_FLUSH_SECONDS = float(os.getenv("PYMAVLINK_EMIT_FLUSH_MS", "10")) / 1000
+
+# Unbuffered binary stdout: each flush of the emit buffer is one write()
+# straight to the pipe, without the TextIOWrapper/BufferedWriter layers.
+# Opened together with the flusher thread so importing needs no real fd.
+_stdout: Optional[io.FileIO] = None
+_emit_buffer: List[bytes] = []
+_emit_telemetry_index: Optional[int] = None
+_emit_lock = threading.Lock()
+# Held across buffer swap + write so concurrent flushes neither interleave
+# partial writes nor reorder batches.
+_emit_write_lock = threading.Lock()
+_emit_event = threading.Event()
+_emit_flusher: Optional[threading.Thread] = None
+
+
+def _flush_emit_buffer() -> None:
+    global _emit_buffer, _emit_telemetry_index
+    with _emit_write_lock:
+        with _emit_lock:
+            chunks = _emit_buffer
+            _emit_buffer = []
+            _emit_telemetry_index = None
+            _emit_event.clear()
+        if chunks:
+            data = memoryview(b"".join(chunks))
+            while data:
+                written = _stdout.write(data)
+                data = data[written:]
+
+
+def _emit_flush_loop() -> None:
+    while True:
+        _emit_event.wait()
+        # Let messages produced within the window pile up into one write.
+        time.sleep(EMIT_FLUSH_SECONDS)
+        try:
+            _flush_emit_buffer()
+        except OSError:
+            # The parent closed our stdout (e.g. Node exited); nothing can drain
+            # the buffer any more, so exit instead of running on as an orphan.
+            os._exit(1)
+
+
+def _enqueue_line(line: bytes, telemetry: bool = False) -> None:
+    global _emit_telemetry_index, _emit_flusher, _stdout
+    with _emit_lock:
+        if telemetry:
+            # A newer telemetry snapshot supersedes any still-pending one.
+            if _emit_telemetry_index is not None:
+                _emit_buffer[_emit_telemetry_index] = b""
+            _emit_telemetry_index = len(_emit_buffer)
+        _emit_buffer.append(line)
+        if _emit_flusher is None:
+            _stdout = os.fdopen(sys.stdout.fileno(), "wb", buffering=0, closefd=False)
+            _emit_flusher = threading.Thread(target=_emit_flush_loop, daemon=True)
+            _emit_flusher.start()
+    _emit_event.set()
 
 
 def emit(payload: Dict[str, Any]) -> None:
-    sys.stdout.write(json.dumps(payload) + "\n")
-    sys.stdout.flush()
+    _enqueue_line(_dumps(payload), telemetry=payload.get("type") == "telemetry")
+
+
+def emit_telemetry(data: Dict[str, Any]) -> None:
+    _enqueue_line(_TELEMETRY_PREFIX + _encode(data) + _TELEMETRY_SUFFIX, telemetry=True)
 
 
 def log(message: str, level: str = "info") -> None:
@@ -41,7 +172,12 @@ class PymavlinkBridge:
     def __init__(self, connection_string: str) -> None:
         self.connection_string = connection_string
         self.master: Optional[mavutil.mavfile] = None
-        self.command_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        # Commands from stdin and messages from the MAVLink reader share one
+        # queue so the main loop wakes once per event instead of polling.
+        self.event_queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._cmd_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=CMD_WORKERS, thread_name_prefix="mavcmd"
+        )
         self.state: Dict[str, Any] = {
             "lat": None,
             "lon": None,
@@ -74,9 +210,26 @@ class PymavlinkBridge:
         self._vehicle_boot_offset = None
         self._last_vehicle_boot_ms = None
         self._status_hold_until = 0.0
-        self.master_lock = threading.Lock()
+        self._handlers = {
+            "HEARTBEAT": self._handle_heartbeat,
+            "GLOBAL_POSITION_INT": self._handle_global_position_int,
+            "GPS_RAW_INT": self._handle_gps_raw_int,
+            "VFR_HUD": self._handle_vfr_hud,
+        }
+        # recv_match() only treats a str, list or set as a type filter.
+        self._message_types = list(self._handlers)
+        self._state_dirty = False
+        self._last_state_emit = 0.0
+        self._loop_thread: Optional[threading.Thread] = None
+        # Signalled when handlers update fields that wait_until() predicates read.
+        self._state_cv = threading.Condition()
+        # Serializes outbound MAVLink sends; receives run without it.
+        self._send_lock = threading.Lock()
         self.logging_active = False
-        self.csv_rows = []
+        self._csv_columns: Tuple[array.array, ...] = ()
+        self._csv_missing = array.array("H")
+        # Guards SLAM/CSV state shared between the stdin thread and the main loop.
+        self._slam_lock = threading.Lock()
         self.latest_slam = {
             "timestamp": None,
             "x": None,
@@ -116,7 +269,31 @@ class PymavlinkBridge:
                 time.sleep(2)
 
     def emit_state(self) -> None:
-        emit({"type": "telemetry", "data": {**self.state}})
+        was_dirty = self._state_dirty
+        self._state_dirty = True
+        if time.monotonic() - self._last_state_emit >= MIN_STATE_EMIT_INTERVAL:
+            self._emit_state_now()
+        elif not was_dirty and threading.current_thread() is not self._loop_thread:
+            # The main loop may be blocked in event_queue.get(); wake it so the
+            # deferred snapshot goes out once the interval elapses.
+            self.event_queue.put(("flush", None))
+
+    def flush_state(self) -> None:
+        if self._state_dirty and (
+            time.monotonic() - self._last_state_emit >= MIN_STATE_EMIT_INTERVAL
+        ):
+            self._emit_state_now()
+
+    def _state_flush_timeout(self) -> float:
+        if not self._state_dirty:
+            return 1.0
+        elapsed = time.monotonic() - self._last_state_emit
+        return max(MIN_STATE_EMIT_INTERVAL - elapsed, 0.0)
+
+    def _emit_state_now(self) -> None:
+        self._state_dirty = False
+        self._last_state_emit = time.monotonic()
+        emit_telemetry(self.state)
 
     def update_status(self, text: str, hold_seconds: float = None) -> None:
         hold = STATUS_HOLD_SECONDS if hold_seconds is None else hold_seconds
@@ -126,25 +303,50 @@ class PymavlinkBridge:
         self.emit_state()
 
     def stdin_listener(self) -> None:
-        for line in sys.stdin:
+        # Buffered binary reads: lines go to _loads as bytes, no text decode.
+        reader = os.fdopen(sys.stdin.fileno(), "rb", closefd=False)
+        while True:
+            line = reader.readline()
+            if not line:
+                break
             line = line.strip()
             if not line:
                 continue
             try:
-                payload = json.loads(line)
-                self.command_queue.put(payload)
+                payload = _loads(line)
+                if payload.get("type") == "slam_pose":
+                    # High-rate poses skip the event queue entirely.
+                    self.store_slam_pose(payload.get("data"), int(time.time() * 1000))
+                else:
+                    self.event_queue.put(("command", payload))
             except Exception as exc:  # pylint: disable=broad-except
                 log(f"Invalid command payload: {exc}", level="error")
 
-    def process_commands(self) -> None:
-        while True:
+    def mavlink_reader(self, master: mavutil.mavfile) -> None:
+        while self.master is master:
             try:
-                payload = self.command_queue.get_nowait()
-            except queue.Empty:
-                break
+                msg = master.recv_match(
+                    type=self._message_types, blocking=True, timeout=1
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                self.event_queue.put(("error", (master, exc)))
+                return
+            if msg:
+                # Stamp on receipt so queueing delay doesn't skew host timestamps.
+                self.event_queue.put(("mavlink", (msg, int(time.time() * 1000))))
+
+    def dispatch_command(self, payload: Dict[str, Any]) -> None:
+        command_type = payload.get("type")
+        if command_type in INLINE_COMMANDS:
+            self.execute_command(payload)
+        elif command_type == "csv_stop":
+            # Exporting a long log is CPU-bound; keep it off the main loop and
+            # out of the pool, where a takeoff could hold it for minutes.
             threading.Thread(
                 target=self.execute_command, args=(payload,), daemon=True
             ).start()
+        else:
+            self._cmd_pool.submit(self.execute_command, payload)
 
     def execute_command(self, payload: Dict[str, Any]) -> None:
         command_type = payload.get("type")
@@ -187,8 +389,6 @@ class PymavlinkBridge:
                 altitude_value = 30.0
             altitude_value = altitude_value if altitude_value > 0 else 30.0
             self.takeoff_sequence(altitude_value)
-        elif command_type == "slam_pose":
-            self.store_slam_pose(payload.get("data"))
         elif command_type == "csv_start":
             return self.start_csv_logging()
         elif command_type == "csv_stop":
@@ -207,7 +407,7 @@ class PymavlinkBridge:
         extra_flag = MODE_EXTRA_FLAGS.get(mode_name)
         if extra_flag:
             base_mode |= extra_flag
-        with self.master_lock:
+        with self._send_lock:
             self.master.mav.command_long_send(
                 self.master.target_system,
                 self.master.target_component,
@@ -263,7 +463,7 @@ class PymavlinkBridge:
     def arm(self, should_arm: bool) -> None:
         if not self.master:
             raise RuntimeError("Vehicle connection not ready")
-        with self.master_lock:
+        with self._send_lock:
             self.master.mav.command_long_send(
                 self.master.target_system,
                 self.master.target_component,
@@ -281,7 +481,7 @@ class PymavlinkBridge:
     def send_takeoff_command(self, altitude: float) -> None:
         if not self.master:
             raise RuntimeError("Vehicle connection not ready")
-        with self.master_lock:
+        with self._send_lock:
             self.master.mav.command_long_send(
                 self.master.target_system,
                 self.master.target_component,
@@ -296,89 +496,104 @@ class PymavlinkBridge:
                 altitude,
             )
 
-    def wait_until(
-        self, predicate, timeout: float, description: str = "condition", interval: float = 0.5
+    def wait_until(self, predicate, timeout: float, description: str = "condition") -> None:
+        deadline = time.monotonic() + timeout
+        with self._state_cv:
+            while not predicate():
+                if not self.master:
+                    raise RuntimeError(f"Vehicle connection lost waiting for {description}")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for {description}")
+                self._state_cv.wait(timeout=remaining)
+
+    def _notify_state_change(self) -> None:
+        with self._state_cv:
+            self._state_cv.notify_all()
+
+    def store_slam_pose(
+        self, payload: Optional[Dict[str, Any]], now_ms: Optional[int] = None
     ) -> None:
-        end_time = time.monotonic() + timeout
-        while time.monotonic() <= end_time:
-            if predicate():
-                return
-            time.sleep(interval)
-        raise TimeoutError(f"Timed out waiting for {description}")
-
-    def store_slam_pose(self, payload: Optional[Dict[str, Any]]) -> None:
         if not payload:
             return
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
         timestamp = self._safe_float(payload.get("timestamp"))
         if timestamp is None:
-            timestamp = int(time.time() * 1000)
+            timestamp = now_ms
         else:
+            if not math.isfinite(timestamp):
+                return
             timestamp = int(timestamp)
             if timestamp < 1e12:  # assume payload in seconds
                 timestamp = int(timestamp * 1000)
-        x = self._safe_float(payload.get("x"))
-        y = self._safe_float(payload.get("y"))
-        z = self._safe_float(payload.get("z"))
-        qw = self._safe_float(payload.get("qw"))
-        qx = self._safe_float(payload.get("qx"))
-        qy = self._safe_float(payload.get("qy"))
-        qz = self._safe_float(payload.get("qz"))
+            if not 0 <= timestamp <= _MAX_TIMESTAMP_MS:
+                return
+        try:
+            x = float(payload["x"])
+            y = float(payload["y"])
+            z = float(payload["z"])
+            qw = float(payload["qw"])
+            qx = float(payload["qx"])
+            qy = float(payload["qy"])
+            qz = float(payload["qz"])
+        except (KeyError, TypeError, ValueError):
+            x, y, z, qw, qx, qy, qz = self._parse_slam_pose_slow(payload)
         if x is None or y is None or z is None:
             return
-        host_now = int(time.time() * 1000)
-        delta = host_now - timestamp
-        self.state["last_slam_timestamp"] = timestamp
-        self.state["last_slam_host_timestamp"] = host_now
-        self.state["last_slam_delta_ms"] = delta
-        if self._debug_timing and abs(delta) > 250:
-            log(f"SLAM timestamp skew {delta} ms (payload={timestamp})", level="error")
-        self.latest_slam = {
-            "timestamp": int(timestamp),
-            "x": x,
-            "y": y,
-            "z": z,
-            "qw": qw,
-            "qx": qx,
-            "qy": qy,
-            "qz": qz,
-        }
-        if self.logging_active:
-            self.append_log_row()
+        with self._slam_lock:
+            host_now = now_ms
+            delta = host_now - timestamp
+            self.state["last_slam_timestamp"] = timestamp
+            self.state["last_slam_host_timestamp"] = host_now
+            self.state["last_slam_delta_ms"] = delta
+            if self._debug_timing and abs(delta) > 250:
+                log(f"SLAM timestamp skew {delta} ms (payload={timestamp})", level="error")
+            self.latest_slam = {
+                "timestamp": int(timestamp),
+                "x": x,
+                "y": y,
+                "z": z,
+                "qw": qw,
+                "qx": qx,
+                "qy": qy,
+                "qz": qz,
+            }
+            if self.logging_active:
+                self.append_log_row(now_ms)
 
     def start_csv_logging(self) -> None:
-        self.csv_rows = []
-        self.logging_active = True
+        with self._slam_lock:
+            self._csv_columns = tuple(array.array(code) for code in CSV_COLUMN_TYPES)
+            self._csv_missing = array.array("H")
+            self.logging_active = True
         self.update_status("CSV: recording", hold_seconds=2)
         return {"status": "started"}
 
     def stop_csv_logging(self) -> Dict[str, Any]:
         if not self.logging_active:
             raise RuntimeError("CSV belum dimulai")
-        self.logging_active = False
+        with self._slam_lock:
+            self.logging_active = False
+            columns = self._csv_columns
+            missing = self._csv_missing
+            self._csv_columns = ()
+            self._csv_missing = array.array("H")
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(
-            [
-                "timestamp_log",
-                "timestamp_slam",
-                "slam_x",
-                "slam_y",
-                "slam_z",
-                "timestamp_mavlink",
-                "gps_lat",
-                "gps_lon",
-                "gps_alt",
-                "gps_alt_rel",
-            ]
+        writer.writerow(CSV_HEADER)
+        writer.writerows(
+            [None if mask >> index & 1 else value for index, value in enumerate(row)]
+            if mask
+            else row
+            for row, mask in zip(zip(*columns), missing)
         )
-        writer.writerows(self.csv_rows)
         csv_text = output.getvalue()
-        self.csv_rows = []
         file_name = f"slam-log-{int(time.time())}.csv"
         encoded = base64.b64encode(csv_text.encode("utf-8")).decode("ascii")
         return {"csv": encoded, "file_name": file_name}
 
-    def append_log_row(self) -> None:
+    def append_log_row(self, log_time: Optional[int] = None) -> None:
         slam = self.latest_slam
         mav = self.latest_mav
         if (
@@ -388,7 +603,8 @@ class PymavlinkBridge:
             or slam.get("z") is None
         ):
             return
-        log_time = int(time.time() * 1000)
+        if log_time is None:
+            log_time = int(time.time() * 1000)
         log_vs_slam = log_time - slam["timestamp"]
         self.state["last_log_delta_ms"] = log_vs_slam
         if self._debug_timing and abs(log_vs_slam) > 250:
@@ -409,7 +625,27 @@ class PymavlinkBridge:
             mav.get("alt"),
             mav.get("rel"),
         ]
-        self.csv_rows.append(row)
+        mask = 0
+        for index, value in enumerate(row):
+            if value is None:
+                mask |= 1 << index
+                row[index] = 0
+        size = len(self._csv_missing)
+        try:
+            for column, value in zip(self._csv_columns, row):
+                column.append(value)
+            self._csv_missing.append(mask)
+        except (OverflowError, TypeError):
+            # Keep the columns aligned: undo the partial row before re-raising.
+            for column in self._csv_columns:
+                del column[size:]
+            raise
+
+    def _parse_slam_pose_slow(self, payload: Dict[str, Any]) -> tuple:
+        safe_float = self._safe_float
+        return tuple(
+            safe_float(payload.get(key)) for key in ("x", "y", "z", "qw", "qx", "qy", "qz")
+        )
 
     @staticmethod
     def _safe_float(value: Any) -> Optional[float]:
@@ -420,125 +656,166 @@ class PymavlinkBridge:
         except (TypeError, ValueError):
             return None
 
-    def handle_message(self, msg: mavutil.mavlink.MAVLink_message) -> None:
-        mtype = msg.get_type()
-        if mtype == "HEARTBEAT":
-            base_mode = getattr(msg, "base_mode", 0)
-            system_status = getattr(msg, "system_status", None)
-            self.state["armed"] = bool(
-                base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
-            )
-            self.state["ready"] = system_status in (
-                mavutil.mavlink.MAV_STATE_STANDBY,
-                mavutil.mavlink.MAV_STATE_ACTIVE,
-            )
-            if system_status is not None:
-                status_enum = mavutil.mavlink.enums.get("MAV_STATE", {})
-                enum_entry = status_enum.get(system_status)
-                self.state["system_status"] = getattr(enum_entry, "name", str(system_status))
-                if time.monotonic() >= self._status_hold_until:
-                    self.state["status"] = self.state["system_status"]
-                    self.state["statusTimestamp"] = int(time.time() * 1000)
-            self.state["mode"] = mavutil.mode_string_v10(msg) or "UNKNOWN"
-            self.state["mode_id"] = getattr(msg, "custom_mode", None)
-            self.state["system_id"] = msg.get_srcSystem()
-            self.state["component_id"] = msg.get_srcComponent()
-            self.emit_state()
-            return
-        if mtype == "GLOBAL_POSITION_INT":
-            lat = getattr(msg, "lat", None)
-            lon = getattr(msg, "lon", None)
-            alt = getattr(msg, "alt", None)
-            rel = getattr(msg, "relative_alt", None)
-            self.state["lat"] = lat / 1e7 if lat is not None else None
-            self.state["lon"] = lon / 1e7 if lon is not None else None
-            self.state["alt"] = alt / 1000 if alt is not None else None
-            self.state["relative_alt"] = rel / 1000 if rel is not None else None
-            now_ms = int(time.time() * 1000)
-            vehicle_boot = getattr(msg, "time_boot_ms", None)
-            skew_ms = None
-            if isinstance(vehicle_boot, (int, float)):
-                vehicle_boot = int(vehicle_boot)
-                if (
-                    self._vehicle_boot_offset is None
-                    or self._last_vehicle_boot_ms is None
-                    or vehicle_boot < self._last_vehicle_boot_ms
-                ):
-                    self._vehicle_boot_offset = now_ms - vehicle_boot
-                self._last_vehicle_boot_ms = vehicle_boot
-                estimated_host = self._vehicle_boot_offset + vehicle_boot
-                skew_ms = now_ms - estimated_host
-                if self._debug_timing and abs(skew_ms) > 250:
-                    log(
-                        f"GPS timestamp skew {skew_ms} ms "
-                        f"(vehicle_boot={vehicle_boot} offset={self._vehicle_boot_offset})",
-                        level="error",
-                    )
-            timestamp = now_ms
-            self.state["last_gps_host_timestamp"] = now_ms
-            self.state["last_gps_vehicle_timestamp"] = (
-                (vehicle_boot + (self._vehicle_boot_offset or 0)) if vehicle_boot is not None else None
+    def handle_message(
+        self, msg: mavutil.mavlink.MAVLink_message, now_ms: Optional[int] = None
+    ) -> None:
+        handler = self._handlers.get(msg.get_type())
+        if handler:
+            handler(msg, int(time.time() * 1000) if now_ms is None else now_ms)
+
+    def _handle_heartbeat(
+        self, msg: mavutil.mavlink.MAVLink_message, now_ms: int
+    ) -> None:
+        base_mode = getattr(msg, "base_mode", 0)
+        system_status = getattr(msg, "system_status", None)
+        self.state["armed"] = bool(base_mode & _SAFETY_ARMED)
+        self.state["ready"] = system_status in _READY_STATES
+        if system_status is not None:
+            self.state["system_status"] = _MAV_STATE_NAMES.get(
+                system_status, str(system_status)
             )
-            self.state["last_gps_vehicle_skew_ms"] = skew_ms
-            self.latest_mav = {
-                "timestamp": timestamp,
-                "lat": self.state["lat"],
-                "lon": self.state["lon"],
-                "alt": self.state["alt"],
-                "rel": self.state["relative_alt"],
-            }
-            self.emit_state()
-            return
-        if mtype == "GPS_RAW_INT":
-            fix_type = getattr(msg, "fix_type", None)
-            self.state["gps_fix_type"] = fix_type
-            self.state["satellites_visible"] = getattr(msg, "satellites_visible", None)
-            eph = getattr(msg, "eph", None)
-            hdop = None
-            if eph is not None and eph != 65535:
-                try:
-                    hdop = float(eph) / 100.0
-                except (TypeError, ValueError):
-                    hdop = None
-            self.state["hdop"] = hdop
-            self.emit_state()
+            if time.monotonic() >= self._status_hold_until:
+                self.state["status"] = self.state["system_status"]
+                self.state["statusTimestamp"] = now_ms
+        self.state["mode"] = mavutil.mode_string_v10(msg) or "UNKNOWN"
+        self.state["mode_id"] = getattr(msg, "custom_mode", None)
+        self.state["system_id"] = msg.get_srcSystem()
+        self.state["component_id"] = msg.get_srcComponent()
+        self.emit_state()
+        self._notify_state_change()
+
+    def _handle_global_position_int(
+        self, msg: mavutil.mavlink.MAVLink_message, now_ms: int
+    ) -> None:
+        try:
+            lat = msg.lat
+            lon = msg.lon
+            alt = msg.alt
+            rel = msg.relative_alt
+            vehicle_boot = msg.time_boot_ms
+        except AttributeError:
             return
-        if mtype == "VFR_HUD":
-            self.state["heading"] = self._safe_float(getattr(msg, "heading", None))
-            self.state["baro_alt"] = self._safe_float(getattr(msg, "alt", None))
-            self.state["climb"] = self._safe_float(getattr(msg, "climb", None))
-            self.emit_state()
+        # Round to the wire resolution (1e-7 deg, 1 mm) to keep payloads short.
+        lat = round(lat * 1e-7, 7)
+        lon = round(lon * 1e-7, 7)
+        alt = round(alt * 1e-3, 3)
+        rel = round(rel * 1e-3, 3)
+        self.state["lat"] = lat
+        self.state["lon"] = lon
+        self.state["alt"] = alt
+        self.state["relative_alt"] = rel
+        skew_ms = None
+        if isinstance(vehicle_boot, (int, float)):
+            vehicle_boot = int(vehicle_boot)
+            if (
+                self._vehicle_boot_offset is None
+                or self._last_vehicle_boot_ms is None
+                or vehicle_boot < self._last_vehicle_boot_ms
+            ):
+                self._vehicle_boot_offset = now_ms - vehicle_boot
+            self._last_vehicle_boot_ms = vehicle_boot
+            estimated_host = self._vehicle_boot_offset + vehicle_boot
+            skew_ms = now_ms - estimated_host
+            if self._debug_timing and abs(skew_ms) > 250:
+                log(
+                    f"GPS timestamp skew {skew_ms} ms "
+                    f"(vehicle_boot={vehicle_boot} offset={self._vehicle_boot_offset})",
+                    level="error",
+                )
+        timestamp = now_ms
+        self.state["last_gps_host_timestamp"] = now_ms
+        self.state["last_gps_vehicle_timestamp"] = (
+            (vehicle_boot + (self._vehicle_boot_offset or 0)) if vehicle_boot is not None else None
+        )
+        self.state["last_gps_vehicle_skew_ms"] = skew_ms
+        self.latest_mav = {
+            "timestamp": timestamp,
+            "lat": lat,
+            "lon": lon,
+            "alt": alt,
+            "rel": rel,
+        }
+        self.emit_state()
+        self._notify_state_change()
+
+    def _handle_gps_raw_int(
+        self, msg: mavutil.mavlink.MAVLink_message, now_ms: int
+    ) -> None:
+        fix_type = getattr(msg, "fix_type", None)
+        self.state["gps_fix_type"] = fix_type
+        self.state["satellites_visible"] = getattr(msg, "satellites_visible", None)
+        eph = getattr(msg, "eph", None)
+        hdop = None
+        if eph is not None and eph != 65535:
+            try:
+                hdop = float(eph) / 100.0
+            except (TypeError, ValueError):
+                hdop = None
+        self.state["hdop"] = hdop
+        self.emit_state()
+
+    def _handle_vfr_hud(self, msg: mavutil.mavlink.MAVLink_message, now_ms: int) -> None:
+        try:
+            heading = msg.heading
+            baro_alt = msg.alt
+            climb = msg.climb
+        except AttributeError:
             return
+        self.state["heading"] = round(float(heading), 2)
+        self.state["baro_alt"] = round(float(baro_alt), 2)
+        self.state["climb"] = round(float(climb), 2)
+        self.emit_state()
 
     def run(self) -> None:
+        self._loop_thread = threading.current_thread()
         threading.Thread(target=self.stdin_listener, daemon=True).start()
         while True:
             try:
                 self.connect()
-                while True:
-                    if not self.master:
-                        break
-                    msg = None
-                    with self.master_lock:
-                        if self.master:
-                            msg = self.master.recv_match(blocking=True, timeout=1)
-                    if msg:
-                        self.handle_message(msg)
-                    self.process_commands()
+                master = self.master
+                threading.Thread(
+                    target=self.mavlink_reader, args=(master,), daemon=True
+                ).start()
+                while self.master is master:
+                    try:
+                        kind, item = self.event_queue.get(timeout=self._state_flush_timeout())
+                    except queue.Empty:
+                        self.flush_state()
+                        continue
+                    if kind == "mavlink":
+                        self.handle_message(*item)
+                    elif kind == "command":
+                        self.dispatch_command(item)
+                    elif kind == "error":
+                        source, exc = item
+                        if source is master:
+                            raise exc
+                    self.flush_state()
             except Exception as exc:  # pylint: disable=broad-except
                 log(f"Bridge loop error: {exc}", level="error")
             except KeyboardInterrupt:
                 log("Bridge interrupted", level="error")
                 break
             finally:
-                if self.master:
-                    try:
-                        self.master.close()
-                    except Exception:  # pylint: disable=broad-except
-                        pass
-                    self.master = None
+                # Holding _send_lock keeps close() from racing an in-flight send.
+                # Clearing self.master first stops mavlink_reader, and any error
+                # from its interrupted recv is ignored as coming from a stale master.
+                with self._send_lock:
+                    master, self.master = self.master, None
+                    if master:
+                        try:
+                            master.close()
+                        except Exception:  # pylint: disable=broad-except
+                            pass
+                # Let a takeoff blocked in wait_until() see the connection is gone.
+                self._notify_state_change()
                 time.sleep(2)
 
+    def shutdown(self) -> None:
+        # Pool workers are joined at interpreter exit; drop queued commands so
+        # only an in-flight one (aborted via wait_until) is waited for.
+        self._cmd_pool.shutdown(wait=False, cancel_futures=True)
+
 
 def main() -> None:
     bridge = PymavlinkBridge(DEFAULT_CONNECTION)
@@ -546,6 +823,9 @@ def main() -> None:
         bridge.run()
     except KeyboardInterrupt:
         log("Bridge terminated by KeyboardInterrupt", level="error")
+    finally:
+        bridge.shutdown()
+        _flush_emit_buffer()
 
 
 if __name__ == "__main__":